@@ -1,8 +1,7 @@
 import omni.usd
 import omni.ui as ui
-from pxr import Usd, UsdGeom, Gf, Vt
-import math
-import random
+from pxr import Usd, UsdGeom, Vt
+import numpy as np
 
 # =============================================================================
 # 5G RF SIGNAL HEATMAP VISUALIZATION - UPGRADED
@@ -22,14 +21,26 @@ MIN_SIGNAL_RANGE = 5.0      # Minimum distance from tower (meters)
 POINTS_PER_TOWER = 400      # Number of dots per antenna (more = denser heatmap)
                             # Recommended: 200-600
                             # Higher values = smoother but slower
+MAX_TOTAL_POINTS = 50000    # Cap on dots across all towers combined
+                            # Points per tower shrink when many towers are visible
 
 # Point Appearance
 POINT_SIZE = 4.0            # Size of each dot (1-10)
 
+# Console Output
+VERBOSE = False             # Print every found tower and debug samples
+                            # (slows down scenes with many towers)
+
 # ┌─────────────────────────────────────────────────────────────────────────┐
 # │ END OF USER CONFIGURATION                                               │
 # └─────────────────────────────────────────────────────────────────────────┘
 
+# Random generator for distance and height jitter (seeded for reproducible heatmaps)
+_rng = np.random.default_rng(seed=42)
+
+# Number of evenly spaced distance rings each tower's points are spread over
+_NUM_RINGS = 20
+
 # Create UI Window with Sliders
 def create_control_window():
     """Create a floating control panel with sliders"""
@@ -116,9 +127,9 @@ def create_control_window():
 # Show control window
 control_window = create_control_window()
 
-def calculate_gradient_color(signal_strength):
+def calculate_gradient_colors(signal_strengths):
     """
-    Calculate smooth gradient color based on signal strength
+    Calculate smooth gradient colors based on signal strength
     
     Signal Strength Scale:
         100% = Pure Green (excellent signal)
@@ -130,99 +141,197 @@ def calculate_gradient_color(signal_strength):
         50-100%: Yellow (1,1,0) → Green (0,1,0)
     
     Args:
-        signal_strength: Float 0-100 representing signal quality
+        signal_strengths: Array of floats 0-100 representing signal quality
     
     Returns:
-        Gf.Vec3f: RGB color value (0-1 range)
+        np.ndarray: (N, 3) float32 RGB color values (0-1 range)
     """
-    # Clamp to 0-100 range
-    signal_strength = max(0.0, min(100.0, signal_strength))
+    # Clamp to 0-100 range and normalize so 1.0 = yellow
+    s = np.clip(signal_strengths, 0.0, 100.0) / 50.0
     
-    if signal_strength > 50.0:
-        # Strong signal: Yellow (1,1,0) → Green (0,1,0)
-        # As signal increases, reduce red component
-        normalized = (signal_strength - 50.0) / 50.0  # 0.0 to 1.0
-        r = 1.0 - normalized  # Fade from 1 to 0
-        g = 1.0               # Always full green
-        b = 0.0
-    else:
-        # Weak signal: Red (1,0,0) → Yellow (1,1,0)
-        # As signal increases, increase green component
-        normalized = signal_strength / 50.0  # 0.0 to 1.0
-        r = 1.0               # Always full red
-        g = normalized        # Fade from 0 to 1
-        b = 0.0
+    # Strong signal (s > 1): Yellow → Green, red fades from 1 to 0
+    # Weak signal (s <= 1):  Red → Yellow, green fades from 0 to 1
+    r = np.where(s > 1.0, 2.0 - s, 1.0)
+    g = np.where(s > 1.0, 1.0, s)
     
-    return Gf.Vec3f(r, g, b)
+    return np.stack([r, g, np.zeros_like(r)], axis=1).astype(np.float32)
 
 
-def calculate_signal_strength(distance, max_distance=150.0, min_distance=5.0):
+def _uniform_float32(low, high, shape):
+    """Draw float32 samples uniformly from [low, high) using the module generator"""
+    return low + (high - low) * _rng.random(shape, dtype=np.float32)
+
+
+def generate_signal_points(tower_positions, points_per_tower, min_range, max_range):
     """
-    Calculate signal strength - simple inverse relationship
+    Generate heatmap sample points for all towers in one vectorized pass
+    
+    Points are laid out tower by tower, and within a tower ring by ring, so
+    every array is computed with a (towers, points) shape instead of a Python
+    loop over towers.
     
     Args:
-        distance: Distance from tower in meters
-        max_distance: Maximum effective range
-        min_distance: Minimum distance (where signal is strongest)
+        tower_positions: Sequence of (x, y, z) tower antenna positions
+        points_per_tower: Requested number of dots per antenna
+        min_range: Minimum distance from tower (meters)
+        max_range: Maximum distance signal reaches (meters)
     
     Returns:
-        Float 0-100: Signal strength percentage
+        tuple: (points, distances, signal_strengths) where points is an
+        (N, 3) float32 array and the others are length-N float32 arrays
+    """
+    # All math stays in float32, the precision USD stores points and colors in
+    origins = np.asarray(tower_positions, dtype=np.float32)
+    
+    # Create distance bands to ensure we get full gradient
+    num_rings = _NUM_RINGS
+    points_per_ring = points_per_tower // num_rings
+    
+    # Ring distances (evenly distributed), one entry per point of a tower
+    ring_progress = np.linspace(0.0, 1.0, num_rings, dtype=np.float32)
+    dist_base = np.repeat(min_range + (max_range - min_range) * ring_progress, points_per_ring)
+    shape = (origins.shape[0], dist_base.shape[0])
+    
+    # Golden-angle spiral: successive points advance by ~137.5°, which covers the
+    # circle evenly without any random draws. The pattern is shared by all towers.
+    golden_angle = np.pi * (3.0 - np.sqrt(5.0))
+    angles = ((np.arange(shape[1]) * golden_angle) % (2.0 * np.pi)).astype(np.float32)
+    
+    # Add small random variation to distance within ring (±5m)
+    jitter = _uniform_float32(-5.0, 5.0, shape)
+    distances = np.clip(dist_base + jitter, min_range, max_range)
+    
+    # Signal strength - simple inverse relationship: 100% at min_range, 0% at max_range.
+    # Distances are already clamped to the valid range, so no further clamping is needed.
+    signal_strengths = (max_range - distances) * (100.0 / (max_range - min_range))
+    
+    # Output buffer for every point of every tower; coordinates are written
+    # straight into its columns to avoid building intermediate arrays
+    points = np.empty(shape + (3,), dtype=np.float32)
+    target_x, target_y, target_z = points[..., 0], points[..., 1], points[..., 2]
+    
+    # Calculate point positions (polar -> cartesian)
+    np.multiply(distances, np.cos(angles), out=target_x)
+    np.multiply(distances, np.sin(angles), out=target_y)
+    target_x += origins[:, 0:1]
+    target_y += origins[:, 1:2]
+    
+    # Height varies based on signal strength for layered effect
+    # Strong signals (green) show at ground level
+    # Weak signals (red) show at higher elevation with more variation
+    z_strong = -25.0 + _uniform_float32(-5.0, 5.0, shape)
+    z_weak = -10.0 + _uniform_float32(-10.0, 10.0, shape)
+    target_z[...] = np.where(signal_strengths > 50.0, z_strong, z_weak)
+    target_z += origins[:, 2:3] - 5.0  # Base height sits 5m below the antenna
+    
+    return points.reshape(-1, 3), distances.ravel(), signal_strengths.ravel()
+
+
+def write_heatmap_attributes(points_prim, points, colors):
+    """
+    Write heatmap points, colors and POINT_SIZE widths onto the visualizer prim
+    
+    Args:
+        points_prim: UsdGeom.Points visualizer prim
+        points: (N, 3) float32 array of point positions
+        colors: (N, 3) float32 array of RGB colors
     """
-    # Clamp distance to valid range
-    distance = max(min_distance, min(max_distance, distance))
+    # Write Data with explicit vertex interpolation
+    points_prim.GetPointsAttr().Set(Vt.Vec3fArray.FromNumpy(points))
     
-    # Linear interpolation: at min_distance = 100%, at max_distance = 0%
-    signal_strength = 100.0 * (max_distance - distance) / (max_distance - min_distance)
+    # CRITICAL: Set displayColor primvar with VERTEX interpolation
+    # This ensures each point gets its own unique color
+    color_primvar = points_prim.GetDisplayColorPrimvar()
+    color_primvar.Set(Vt.Vec3fArray.FromNumpy(colors))
+    color_primvar.SetInterpolation('vertex')
     
-    return max(0.0, min(100.0, signal_strength))
+    # Set widths array (one per point) to match POINT_SIZE
+    widths_array = Vt.FloatArray.FromNumpy(np.full(len(points), POINT_SIZE, dtype=np.float32))
+    widths_attr = points_prim.GetWidthsAttr()
+    if not widths_attr:
+        widths_attr = points_prim.CreateWidthsAttr()
+    widths_attr.Set(widths_array)
+
+
+# Heatmap currently on the stage: its settings key, generated data, and the
+# POINT_SIZE its widths were written with
+_heatmap_cache = {"key": None, "points": None, "colors": None, "point_size": None}
 
 
 def generate_heatmap():
     """Generate the heatmap visualization"""
-    # 1. SETUP (Get or Create the Visualizer)
     stage = omni.usd.get_context().get_stage()
     vis_path = "/World/Signal_Visualizer"
 
-    # DELETE and recreate the prim to force size update
-    if stage.GetPrimAtPath(vis_path):
-        stage.RemovePrim(vis_path)
-    
-    # Define creates it fresh
-    points_prim = UsdGeom.Points.Define(stage, vis_path)
-
-    # Make it pickable/selectable so you can see it in the stage
-    imageable = UsdGeom.Imageable(points_prim)
-
-    # 2. SCAN FOR VISIBLE TOWERS
+    # 1. SCAN FOR VISIBLE TOWERS
     tower_positions = []
     print("="*60)
     print("5G RF SIGNAL HEATMAP GENERATOR v2.0")
     print("="*60)
     print("Scanning for VISIBLE Towers...")
     
+    # Shared cache so sibling towers reuse their parents' world transforms
+    xform_cache = UsdGeom.XformCache(0)
+    
     for prim in stage.Traverse():
         if "Tower" in prim.GetName() and prim.IsA(UsdGeom.Xformable):
-            # Check Visibility
-            prim_imageable = UsdGeom.Imageable(prim)
-            visibility = prim_imageable.GetVisibilityAttr().Get()
-            
-            if visibility == 'invisible':
+            # Check Visibility (includes visibility inherited from parents)
+            if UsdGeom.Imageable(prim).ComputeVisibility() == 'invisible':
                 continue 
                 
-            xform = UsdGeom.Xformable(prim)
-            world_transform = xform.ComputeLocalToWorldTransform(0)
+            world_transform = xform_cache.GetLocalToWorldTransform(prim)
             trans = world_transform.ExtractTranslation()
-            tower_positions.append(Gf.Vec3f(trans[0], trans[1], trans[2] + 5.0))
-            print(f"  ✓ Found: {prim.GetName()} at ({trans[0]:.1f}, {trans[1]:.1f}, {trans[2]:.1f})")
+            tower_positions.append((trans[0], trans[1], trans[2] + 5.0))
+            if VERBOSE:
+                print(f"  ✓ Found: {prim.GetName()} at ({trans[0]:.1f}, {trans[1]:.1f}, {trans[2]:.1f})")
 
     print(f"Total Active Towers: {len(tower_positions)}")
     print("-"*60)
 
+    # 2. CHECK WHETHER THE CURRENT HEATMAP CAN BE REUSED (ONLY POINT SIZE CHANGED)
+    heatmap_key = (stage.GetRootLayer().identifier, POINTS_PER_TOWER, MAX_SIGNAL_RANGE,
+                   MIN_SIGNAL_RANGE, tuple(tower_positions))
+    existing_prim = stage.GetPrimAtPath(vis_path)
+    
+    # The prim must still hold the cached heatmap (an undo or manual edit may have changed it)
+    existing_points = None
+    if existing_prim and existing_prim.IsA(UsdGeom.Points):
+        existing_points = UsdGeom.Points(existing_prim).GetPointsAttr().Get()
+    
+    reuse_heatmap = (tower_positions and _heatmap_cache["key"] == heatmap_key
+                     and existing_points is not None
+                     and len(existing_points) == len(_heatmap_cache["points"]))
 
-    # 3. GENERATE HEATMAP VISUALIZATION
-    final_points = []
-    final_colors = []
+    # 3. SETUP (Get or Create the Visualizer)
+    # Changing widths in place is not reliably picked up by the renderer, so
+    # DELETE and recreate the prim whenever POINT_SIZE changed to force size update.
+    # Otherwise reuse it and only rewrite its attributes.
+    size_changed = _heatmap_cache["point_size"] != POINT_SIZE
+    if existing_points is not None and not size_changed:
+        points_prim = UsdGeom.Points(existing_prim)
+    else:
+        if existing_prim:
+            stage.RemovePrim(vis_path)
+        points_prim = UsdGeom.Points.Define(stage, vis_path)
 
+    # Make it pickable/selectable so you can see it in the stage
+    imageable = UsdGeom.Imageable(points_prim)
+    
+    if reuse_heatmap:
+        # Refresh always shows the visualizer, even if it was hidden in the stage
+        imageable.GetVisibilityAttr().Set('inherited')
+        
+        # A recreated prim gets the cached heatmap written back with the new widths
+        if size_changed:
+            write_heatmap_attributes(points_prim, _heatmap_cache["points"], _heatmap_cache["colors"])
+            _heatmap_cache["point_size"] = POINT_SIZE
+        
+        print("Towers and signal settings unchanged - reused the current heatmap.")
+        print(f"  Point size: {POINT_SIZE}")
+        print("="*60)
+        return
+
+    # 4. GENERATE HEATMAP VISUALIZATION
     if not tower_positions:
         print("STATUS: No visible towers detected.")
         print("ACTION: Hiding signal visualizer.")
@@ -233,6 +342,8 @@ def generate_heatmap():
         # ACTION 2: Empty the data
         points_prim.GetPointsAttr().Set([])
         points_prim.GetDisplayColorAttr().Set([])
+        points_prim.GetWidthsAttr().Set([])
+        _heatmap_cache.update(key=None, points=None, colors=None, point_size=None)
         
         print("✓ Visualizer hidden and cleared.")
 
@@ -242,129 +353,71 @@ def generate_heatmap():
         # ACTION 1: Force Visibility to Visible
         imageable.GetVisibilityAttr().Set('inherited')
         
-        # Use configuration from top of file
-        points_per_tower = POINTS_PER_TOWER
+        # Use configuration from top of file, spreading MAX_TOTAL_POINTS across
+        # towers so large scenes keep a bounded point count. Every tower keeps at
+        # least one point per distance ring, even if that exceeds the cap.
+        points_per_tower = min(POINTS_PER_TOWER, MAX_TOTAL_POINTS // len(tower_positions))
+        points_per_tower = max(points_per_tower, _NUM_RINGS)
+        if points_per_tower < POINTS_PER_TOWER:
+            print(f"  Capping points per tower at {points_per_tower} (MAX_TOTAL_POINTS = {MAX_TOTAL_POINTS:,})")
         max_range = MAX_SIGNAL_RANGE
         min_range = MIN_SIGNAL_RANGE
         
-        # Generate heatmap points for each tower
-        for tower_idx, origin in enumerate(tower_positions):
-            print(f"  Processing Tower {tower_idx+1}/{len(tower_positions)}...")
-            
-            # Base height for signal visualization
-            base_height = origin[2] - 5.0
-            
-            # Create distance bands to ensure we get full gradient
-            num_rings = 20  # Number of distance rings
-            points_per_ring = points_per_tower // num_rings
-            
-            for ring_idx in range(num_rings):
-                # Calculate distance for this ring (evenly distributed)
-                ring_progress = ring_idx / (num_rings - 1) if num_rings > 1 else 0
-                dist = min_range + (max_range - min_range) * ring_progress
-                
-                # Add variation to distance within ring
-                for _ in range(points_per_ring):
-                    # Random angle (0-360 degrees)
-                    angle = random.uniform(0, 2 * math.pi)
-                    
-                    # Add small random variation to distance (±5m)
-                    actual_dist = dist + random.uniform(-5, 5)
-                    actual_dist = max(min_range, min(max_range, actual_dist))
-                    
-                    # Calculate point position
-                    target_x = origin[0] + actual_dist * math.cos(angle)
-                    target_y = origin[1] + actual_dist * math.sin(angle)
-                    
-                    # Calculate signal strength at this distance
-                    signal_strength = calculate_signal_strength(actual_dist, max_range, min_range)
-                    
-                    # Debug: Print first few calculations
-                    if tower_idx == 0 and ring_idx == 0 and _ < 3:
-                        print(f"    DEBUG: dist={actual_dist:.1f}m, signal={signal_strength:.1f}%, max_range={max_range:.1f}m")
-                    
-                    # Get smooth gradient color based on signal strength
-                    color = calculate_gradient_color(signal_strength)
-                    
-                    # Height varies based on signal strength for layered effect
-                    # Strong signals (green) show at ground level
-                    # Weak signals (red) show at higher elevation
-                    if signal_strength > 50.0:
-                        # Strong signal: near ground level
-                        z_offset = -25.0 + random.uniform(-5, 5)
-                    else:
-                        # Weak signal: higher elevation with more variation
-                        z_offset = -10.0 + random.uniform(-10, 10)
-                    
-                    target_z = base_height + z_offset
-                    
-                    # Add point and color to final arrays
-                    final_points.append(Gf.Vec3f(target_x, target_y, target_z))
-                    final_colors.append(color)
+        # Color lookup table: 256 gradient colors indexed by quantized signal strength
+        color_lut = calculate_gradient_colors(np.linspace(0.0, 100.0, 256))
+        
+        # Generate heatmap points for all towers at once
+        final_points, final_dists, final_signals = generate_signal_points(
+            tower_positions, points_per_tower, min_range, max_range)
+        final_colors = color_lut[(final_signals * 2.55).astype(np.uint8)]
         
-        # ACTION 2: Write Data with explicit vertex interpolation
-        points_prim.GetPointsAttr().Set(final_points)
+        # Debug: Print first few calculations
+        if VERBOSE:
+            for actual_dist, signal_strength in zip(final_dists[:3], final_signals[:3]):
+                print(f"    DEBUG: dist={actual_dist:.1f}m, signal={signal_strength:.1f}%, max_range={max_range:.1f}m")
         
-        # CRITICAL: Set displayColor primvar with VERTEX interpolation
-        # This ensures each point gets its own unique color
-        color_primvar = points_prim.GetDisplayColorPrimvar()
-        color_primvar.Set(final_colors)
-        color_primvar.SetInterpolation('vertex')
+        # ACTION 2: Write points, colors and widths
+        write_heatmap_attributes(points_prim, final_points, final_colors)
         
-        # Set widths array (one per point) to match POINT_SIZE
-        num_points = len(final_points)
-        widths_array = [POINT_SIZE] * num_points
-        widths_attr = points_prim.GetWidthsAttr()
-        if not widths_attr:
-            widths_attr = points_prim.CreateWidthsAttr()
-        widths_attr.Set(widths_array)
+        # Remember what was generated so a point-size-only refresh can skip regeneration
+        _heatmap_cache.update(key=heatmap_key, points=final_points, colors=final_colors,
+                              point_size=POINT_SIZE)
         
         # DEBUG: Show first 10 colors to verify they're different
-        print(f"DEBUG - First 10 colors in final_colors array:")
-        for i in range(min(10, len(final_colors))):
-            c = final_colors[i]
-            print(f"  Point {i}: RGB({c[0]:.2f}, {c[1]:.2f}, {c[2]:.2f})")
+        if VERBOSE:
+            print(f"DEBUG - First 10 colors in final_colors array:")
+            for i in range(min(10, len(final_colors))):
+                c = final_colors[i]
+                print(f"  Point {i}: RGB({c[0]:.2f}, {c[1]:.2f}, {c[2]:.2f})")
         
         print("SUCCESS: Signal Map Updated with gradient colors (VERTEX interpolation)")
         
-        # Statistics - Check signal strength distribution
-        all_signals = []
-        for color in final_colors:
-            # Reverse engineer signal strength from color
-            r, g = color[0], color[1]
-            if g == 1.0 and r < 1.0:
-                # Green zone (50-100%)
-                signal = 50.0 + (1.0 - r) * 50.0
-            else:
-                # Red-yellow zone (0-50%)
-                signal = g * 50.0
-            all_signals.append(signal)
-        
-        min_signal = min(all_signals)
-        max_signal = max(all_signals)
-        avg_signal = sum(all_signals) / len(all_signals)
-        
-        # Count colors
-        red_count = sum(1 for s in all_signals if s < 33)
-        yellow_count = sum(1 for s in all_signals if 33 <= s < 66)
-        green_count = sum(1 for s in all_signals if s >= 66)
-        
         total_points = len(final_points)
         print("-"*60)
         print(f"✓ Heatmap generated successfully!")
         print(f"  Total points: {total_points:,}")
-        print(f"  Points per tower: {points_per_tower}")
+        print(f"  Points per tower: {len(final_points) // len(tower_positions)}")
         print(f"  Signal range: {min_range}m - {max_range}m")
         print(f"  Point size: {POINT_SIZE}")
         print(f"  Color scheme: Red (weak) → Yellow (medium) → Green (strong)")
         print()
-        print(f"  Signal Strength Stats:")
-        print(f"    Min: {min_signal:.1f}%  Max: {max_signal:.1f}%  Avg: {avg_signal:.1f}%")
-        print(f"  Color Distribution:")
-        print(f"    🔴 Red (<33%): {red_count} points ({red_count/total_points*100:.1f}%)")
-        print(f"    🟡 Yellow (33-66%): {yellow_count} points ({yellow_count/total_points*100:.1f}%)")
-        print(f"    🟢 Green (>66%): {green_count} points ({green_count/total_points*100:.1f}%)")
-        print()
+        
+        if total_points:
+            # Statistics - Check signal strength distribution
+            min_signal = final_signals.min()
+            max_signal = final_signals.max()
+            avg_signal = final_signals.mean()
+            
+            # Count colors (<33% red, 33-66% yellow, >=66% green)
+            red_count, yellow_count, green_count = np.histogram(final_signals, bins=[0, 33, 66, 101])[0]
+            
+            print(f"  Signal Strength Stats:")
+            print(f"    Min: {min_signal:.1f}%  Max: {max_signal:.1f}%  Avg: {avg_signal:.1f}%")
+            print(f"  Color Distribution:")
+            print(f"    🔴 Red (<33%): {red_count} points ({red_count/total_points*100:.1f}%)")
+            print(f"    🟡 Yellow (33-66%): {yellow_count} points ({yellow_count/total_points*100:.1f}%)")
+            print(f"    🟢 Green (>66%): {green_count} points ({green_count/total_points*100:.1f}%)")
+            print()
         print("To adjust settings, edit the configuration at the top of this script:")
         print("  - MAX_SIGNAL_RANGE: Change signal distance")
         print("  - POINTS_PER_TOWER: Change density (number of dots)")